@@ -0,0 +1,34 @@
+import re
+
+# "used 2 eggs", "i ate 1.5 apples" - simple enough to parse without a Gemini round-trip
+FAST_VOICE_RE = re.compile(r"(?:i\s+)?(?:used?|had|ate)\s+(\d+(?:\.\d+)?)\s+([a-z]+)")
+IRREGULAR_PLURALS = {"leaves": "leaf", "loaves": "loaf", "halves": "half", "knives": "knife"}
+
+
+def singularize(word: str) -> str:
+    if word in IRREGULAR_PLURALS:
+        return IRREGULAR_PLURALS[word]
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes", "sses")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def match_simple_command(text: str, known_names):
+    """Return (item_name, quantity) for a simple command about a known item, else None.
+
+    The suffix rules are only a guess ("cookies" -> "cooky", "hummus" -> "hummu") and
+    unit words look like items ("had 3 kg"), so the name must already be in the
+    inventory; anything else goes to Gemini.
+    """
+    m = FAST_VOICE_RE.fullmatch(text)
+    if m is None:
+        return None
+    word = m[2]
+    for name in (singularize(word), word[:-1], word):
+        if name and name in known_names:
+            return name, float(m[1])
+    return None
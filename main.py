@@ -1,38 +1,200 @@
-from fastapi import UploadFile, File, FastAPI, HTTPException
+from fastapi import UploadFile, File, FastAPI, HTTPException, Header, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
+from fastapi.responses import JSONResponse
+from PIL import Image, ImageOps
+import anyio
+import hashlib
+import asyncio
 import io
 import os
-import json
+import sqlite3
+import msgspec
+import orjson
+import httpx
+from cachetools import TTLCache
 from pydantic import BaseModel
-from supabase import create_client, Client
+from postgrest.exceptions import APIError
+from supabase import acreate_client, AsyncClient, AsyncClientOptions
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 import google.generativeai as genai
+from fast_path import match_simple_command
 
 # --- CONFIG ---
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+# Comma-separated frontend origins, e.g. "https://stockify.app, http://localhost:5173".
+# The default only covers local dev: production must set this or the deployed frontend is blocked.
+ALLOWED_ORIGINS = [
+    origin.strip()
+    for origin in os.environ.get("ALLOWED_ORIGINS", "http://localhost:3000,http://localhost:5173").split(",")
+    if origin.strip()
+]
 
 if not SUPABASE_URL: print("WARNING: Secrets missing!")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Created on startup so it shares the event loop; one pooled keep-alive client for every Supabase call
+supabase: AsyncClient = None
+http_client: httpx.AsyncClient = None
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-2.5-flash')
 
-app = FastAPI()
+# Parsed Gemini output for /voice-action, keyed by normalized command text
+voice_cache = TTLCache(maxsize=1024, ttl=3600)
+# Paraphrase-level fallback ("I used two eggs" vs "used two eggs"), namespaced per session.
+# Optional: needs sqlite-vec and a Python whose sqlite3 can load extensions.
+try:
+    from semantic_cache import SemanticCache, mentions
+    semantic_cache = SemanticCache(os.environ.get("SEMANTIC_CACHE_PATH", "voice_cache.db"))
+except (ImportError, AttributeError, sqlite3.Error) as e:
+    print(f"WARNING: Semantic cache disabled: {e}")
+    semantic_cache = None
+# Inventory snapshot, its encoded body/ETag and the shopping list; every write clears them
+inv_cache = TTLCache(maxsize=3, ttl=15)
+# item_name (stored lowercase) -> row, seeded on startup and re-read after every write, so the
+# AI handlers resolve names without a Supabase lookup. Quantities here are never written back.
+INV_BY_NAME: dict[str, dict] = {}
+# Bumped by every write; a refresh that started before the latest bump may hold pre-write rows,
+# so its result is returned to its caller but never published to inv_cache / INV_BY_NAME
+inv_generation = 0
+# Caps concurrent deferred writes so bursts don't trip Supabase rate limits
+db_limiter = anyio.CapacityLimiter(10)
+
+# Handlers return plain dicts, so FastAPI's Pydantic serialization doesn't apply; render them with orjson
+# (fastapi.responses.ORJSONResponse does the same but is deprecated)
+class OrjsonResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+app = FastAPI(default_response_class=OrjsonResponse)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=ALLOWED_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup():
+    global supabase, http_client
+    http_client = httpx.AsyncClient(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30),
+    )
+    supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY, AsyncClientOptions(httpx_client=http_client))
+    await refresh_inventory()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await http_client.aclose()
+
+# --- DB WRITES ---
+# Failures where the write is known not to have run: gateway rejections (non-JSON errors carry
+# the HTTP code) and rolled-back Postgres transactions. Timeouts after sending are left alone,
+# since a delta that did commit would be applied twice.
+TRANSIENT_CODES = {"429", "503", "40001", "40P01", "53300"}
+
+def is_transient(exc):
+    if isinstance(exc, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    return isinstance(exc, APIError) and str(exc.code) in TRANSIENT_CODES
+
+retry_writes = retry(
+    retry=retry_if_exception(is_transient),
+    wait=wait_exponential_jitter(initial=0.1, max=2.0, jitter=0.1),
+    stop=stop_after_attempt(4),
+    reraise=True,
+)
+
+@retry_writes
+async def safe_adjust(changes, create_missing=False):
+    global inv_generation
+    # Quantities change by delta inside Postgres (see adjust_inventory() migration), so
+    # concurrent requests and other workers can't overwrite each other's updates
+    response = await supabase.rpc("adjust_inventory", {"changes": changes, "create_missing": create_missing}).execute()
+    if response.data:
+        inv_generation += 1
+        inv_cache.clear()
+    return response.data
+
+# --- PROMPTS ---
+# Static instructions and examples come first so Gemini can reuse the cached prefix;
+# only the user command / bill image is appended at the end.
+VOICE_PROMPT_PREFIX = """You turn kitchen voice commands into inventory actions.
+
+Return JSON only: { "actions": [ { "action_type": "USE", "item": "egg", "quantity": 2 } ] }
+
+RULES:
+- action_type is "USE" whenever food is used, eaten, cooked, finished or thrown away.
+- item is a singular, lowercase food name ("eggs" -> "egg", "Tomatoes" -> "tomato").
+- quantity is a number; convert words to digits ("two" -> 2, "half" -> 0.5). Default to 1.
+- One action per item mentioned. If nothing was used, return { "actions": [] }.
+
+EXAMPLES:
+Command: "used 2 eggs"
+{ "actions": [ { "action_type": "USE", "item": "egg", "quantity": 2 } ] }
+
+Command: "I made an omelette with three eggs and some cheese"
+{ "actions": [ { "action_type": "USE", "item": "egg", "quantity": 3 }, { "action_type": "USE", "item": "cheese", "quantity": 1 } ] }
+
+Command: "we finished half a liter of milk and two tomatoes"
+{ "actions": [ { "action_type": "USE", "item": "milk", "quantity": 0.5 }, { "action_type": "USE", "item": "tomato", "quantity": 2 } ] }
+
+Command: "what's for dinner?"
+{ "actions": [] }
+
+USER COMMAND: \""""
+VOICE_PROMPT_SUFFIX = '"'
+
+BILL_PROMPT = """You extract food items from photos of grocery bills and receipts.
+
+Return JSON only: { "items": [ { "item": "milk", "quantity": 1, "unit": "liter" } ] }
+
+RULES:
+- item is a singular, lowercase food name ("Bananas" -> "banana").
+- quantity is the number of units bought; default to 1.
+- unit is the pack or measure if printed (kg, liter, pack), otherwise "unit".
+- Ignore taxes, discounts, totals, bags and non-food lines.
+
+EXAMPLE:
+Bill lines "AMUL MILK 1L x2", "BANANAS 1.2KG", "GST 5%"
+{ "items": [ { "item": "milk", "quantity": 2, "unit": "liter" }, { "item": "banana", "quantity": 1.2, "unit": "kg" } ] }"""
+
 # --- DATA MODELS ---
 class VoiceCommand(BaseModel):
     text: str
 
+# Gemini output schemas, validated while decoding. Decoding is non-strict because Gemini
+# sometimes quotes numbers ("2"); a null quantity or unit falls back to the default.
+class Action(msgspec.Struct):
+    action_type: str
+    item: str
+    quantity: float | None = 1.0
+
+    def __post_init__(self):
+        if self.quantity is None:
+            self.quantity = 1.0
+
+class VoiceResponse(msgspec.Struct):
+    actions: list[Action] = []
+
+class BillItem(msgspec.Struct):
+    item: str
+    quantity: float | None = 1.0
+    unit: str | None = "unit"
+
+    def __post_init__(self):
+        if self.quantity is None:
+            self.quantity = 1.0
+        if not self.unit:
+            self.unit = "unit"
+
+class BillResponse(msgspec.Struct):
+    items: list[BillItem] = []
+
 class ManualItem(BaseModel):
     item_name: str
     quantity: float
@@ -41,131 +203,194 @@ class ManualItem(BaseModel):
 # --- ROUTES ---
 
 @app.get("/")
-def read_root(): return {"status": "Stockify V3 Online"}
+async def read_root():
+    return OrjsonResponse({"status": "Stockify V3 Online"}, headers={"Cache-Control": "public, max-age=5"})
 
-@app.get("/inventory")
-def get_inventory():
+async def refresh_inventory():
+    generation = inv_generation
     # Sort alphabetically
-    response = supabase.table("inventory").select("*").order('item_name').execute()
+    response = await supabase.table("inventory").select("*").order('item_name').execute()
+    if generation != inv_generation:
+        return response.data
+    INV_BY_NAME.clear()
+    INV_BY_NAME.update((row['item_name'], row) for row in response.data)
+    inv_cache.clear()
+    inv_cache["all"] = response.data
     return response.data
 
+async def load_inventory():
+    rows = inv_cache.get("all")
+    if rows is None:
+        rows = await refresh_inventory()
+    return rows
+
+@app.get("/inventory")
+async def get_inventory(request: Request):
+    # Encode and hash once per snapshot; unchanged inventory answers polls with a bodyless 304
+    cached = inv_cache.get("body")
+    if cached is None:
+        generation = inv_generation
+        body = orjson.dumps(await load_inventory())
+        cached = (body, f'W/"{hashlib.blake2b(body, digest_size=8).hexdigest()}"')
+        if generation == inv_generation:
+            inv_cache["body"] = cached
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "max-age=5"}
+    if etag in (tag.strip() for tag in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
 # NEW: Manual Add Endpoint
 @app.post("/inventory/add")
-def add_manual(item: ManualItem):
-    # Check if item exists (Case insensitive)
-    existing = supabase.table("inventory").select("*").ilike("item_name", item.item_name).execute()
-    
-    if existing.data:
-        # Update existing
-        current_qty = float(existing.data[0]['quantity'])
-        new_qty = current_qty + item.quantity
-        supabase.table("inventory").update({"quantity": new_qty}).eq("id", existing.data[0]['id']).execute()
-        return {"status": "Updated", "new_qty": new_qty, "item": item.item_name}
+async def add_manual(item: ManualItem):
+    # Add in Postgres: creates the row if missing, or adds to one created concurrently.
+    # previous_quantity is null when this call inserted the row.
+    rows = await safe_adjust([{
+        "item_name": item.item_name.lower(), 
+        "delta": item.quantity, 
+        "unit": item.unit
+    }], create_missing=True)
+    await refresh_inventory()
+
+    if rows and rows[0]['previous_quantity'] is not None:
+        return {"status": "Updated", "new_qty": float(rows[0]['quantity']), "item": item.item_name}
     else:
-        # Create new
-        supabase.table("inventory").insert({
-            "item_name": item.item_name, 
-            "quantity": item.quantity, 
-            "unit": item.unit
-        }).execute()
         return {"status": "Created", "item": item.item_name}
 
 # --- NEW: Manual Consume Endpoint (For Cook Tab) ---
 @app.post("/inventory/consume")
-def consume_manual(item: ManualItem):
-    # 1. Find the item (Case insensitive)
-    existing = supabase.table("inventory").select("*").ilike("item_name", item.item_name).execute()
-    
-    if existing.data:
-        current_data = existing.data[0]
-        current_qty = float(current_data['quantity'])
-        
-        # 2. Subtract quantity (ensure it doesn't go below 0)
-        new_qty = max(0, current_qty - item.quantity)
-        
-        # 3. Update DB
-        supabase.table("inventory").update({"quantity": new_qty}).eq("id", current_data['id']).execute()
-        
-        return {
-            "status": "Consumed", 
-            "item": item.item_name, 
-            "previous": current_qty, 
-            "new": new_qty
-        }
-    else:
+async def consume_manual(item: ManualItem):
+    # Subtract quantity in the DB (names are stored lowercase, adjust_inventory never goes
+    # below 0); no row comes back when the item doesn't exist
+    rows = await safe_adjust([{"item_name": item.item_name.lower(), "delta": -item.quantity}])
+    if not rows:
         return {"status": "Error", "message": "Item not found in inventory"}
+    await refresh_inventory()
+
+    return {
+        "status": "Consumed", 
+        "item": item.item_name, 
+        "previous": float(rows[0]['previous_quantity']), 
+        "new": float(rows[0]['quantity'])
+    }
 
 @app.get("/shopping-list")
-def get_shopping_list():
-    response = supabase.table("inventory").select("*").execute()
-    data = response.data
-    shopping_list = []
-    
-    for item in data:
-        safe_limit = item.get('threshold') or 2.0
-        current_qty = float(item['quantity'])
-        if current_qty < safe_limit:
-            needed = safe_limit - current_qty
-            shopping_list.append({
-                "item_name": item['item_name'],
-                "quantity": round(current_qty, 2),
-                "needed": round(needed, 2),
-                "unit": item['unit']
-            })
-    return shopping_list
+async def get_shopping_list():
+    # Threshold filter and "needed" are computed in Postgres (see shopping_list() migration)
+    rows = inv_cache.get("shopping")
+    if rows is None:
+        generation = inv_generation
+        rows = (await supabase.rpc("shopping_list").execute()).data
+        if generation == inv_generation:
+            inv_cache["shopping"] = rows
+    return rows
 
 # --- AI ROUTES ---
+def extract_json(text: str, type):
+    # Slice from the first "{" to the last "}" - skips ```json fences in one pass
+    return msgspec.json.decode(text[text.index("{"):text.rindex("}") + 1], type=type, strict=False)
+
+async def generate_json(contents, type):
+    # .text raises with the finish reason when the reply was blocked or empty
+    response = await model.generate_content_async(contents)
+    return extract_json(response.text, type)
+
+def parse_simple_command(text: str):
+    match = match_simple_command(text, INV_BY_NAME)
+    if match is None:
+        return None
+    name, quantity = match
+    return VoiceResponse(actions=[Action(action_type="USE", item=name, quantity=quantity)])
+
+async def analyze_voice(text: str):
+    return await generate_json(VOICE_PROMPT_PREFIX + text + VOICE_PROMPT_SUFFIX, VoiceResponse)
+
+def shrink_image(contents: bytes) -> bytes:
+    # Phone photos are 3-8 MB; 1600px JPEG keeps the bill legible at a fraction of the upload
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(contents)))
+    img.thumbnail((1600, 1600))
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=85, optimize=True)
+    return buf.getvalue()
+
+# Deferred via BackgroundTasks: the client gets the AI result without waiting on the write
+async def apply_changes(changes, create_missing=False):
+    async with db_limiter:
+        await safe_adjust(changes, create_missing)
+        await refresh_inventory()
+
 @app.post("/voice-action")
-def process_voice(command: VoiceCommand): 
+async def process_voice(command: VoiceCommand, bg: BackgroundTasks, no_cache: bool = False, x_session_id: str = Header("global")):
     try:
-        prompt = f"""
-        Analyze kitchen command: "{command.text}"
-        Return JSON actions: {{ "actions": [ {{ "action_type": "USE", "item": "egg", "quantity": 2 }} ] }}
-        RULES: Singular, Lowercase item names.
-        """
-        res = model.generate_content(prompt)
-        data = json.loads(res.text.replace("```json", "").replace("```", "").strip())
-        
-        actions = data.get("actions", [])
+        key = command.text.lower().strip()
+        data = parse_simple_command(key)
+        if data is None and not no_cache:
+            data = voice_cache.get(key)
+        if data is None and semantic_cache:
+            # Best-effort: a model that fails to load or a locked sqlite file must not fail the request
+            embedding = None
+            try:
+                # Embedding is CPU-bound, keep it off the event loop
+                # A neighbour only counts if this command names the same items ("oat milk" vs "milk")
+                cached, embedding = await asyncio.to_thread(
+                    semantic_cache.lookup, x_session_id, key, VoiceResponse,
+                    lambda cached: all(mentions(key, a.item.lower()) for a in cached.actions),
+                )
+                data = None if no_cache else cached
+            except Exception as e:
+                print(f"WARNING: Semantic cache lookup failed: {e}")
+            if data is None:
+                data = await analyze_voice(command.text)
+                if embedding is not None:
+                    try:
+                        await asyncio.to_thread(semantic_cache.store, x_session_id, key, embedding, data)
+                    except Exception as e:
+                        print(f"WARNING: Semantic cache store failed: {e}")
+        if data is None:
+            data = await analyze_voice(command.text)
+        voice_cache[key] = data
+
+        actions = [a for a in data.actions if a.action_type == "USE"]
         logs = []
+
+        # The index may predate rows added by another worker; only unknown names cost a lookup
+        missing = list({a.item.lower() for a in actions} - INV_BY_NAME.keys())
+        if missing:
+            found = await supabase.table("inventory").select("*").in_("item_name", missing).execute()
+            INV_BY_NAME.update((row['item_name'], row) for row in found.data)
+
+        changes = []
         for action in actions:
-            if action["action_type"] == "USE":
-                name = action["item"]
-                qty = action["quantity"]
-                db_item = supabase.table("inventory").select("*").ilike("item_name", name).execute()
-                if db_item.data:
-                    new_qty = float(db_item.data[0]['quantity']) - float(qty)
-                    supabase.table("inventory").update({"quantity": new_qty}).eq("id", db_item.data[0]['id']).execute()
-                    logs.append(f"Updated {name}")
-                else:
-                    logs.append(f"Could not find {name}")
-        return {"ai_analysis": data, "logs": logs}
+            name = action.item
+            if name.lower() in INV_BY_NAME:
+                changes.append({"item_name": name.lower(), "delta": -action.quantity})
+                logs.append(f"Updated {name}")
+            else:
+                logs.append(f"Could not find {name}")
+
+        if changes:
+            bg.add_task(apply_changes, changes)
+        return {"ai_analysis": msgspec.to_builtins(data), "logs": logs}
     except Exception as e: return {"error": str(e)}
 
 @app.post("/scan-bill")
-async def scan_bill(file: UploadFile = File(...)):
+async def scan_bill(bg: BackgroundTasks, file: UploadFile = File(...)):
     try:
         contents = await file.read()
-        vision_model = genai.GenerativeModel('gemini-2.5-flash') 
-        prompt = """
-        Extract food items from bill. Return JSON: { "items": [ { "item": "milk", "quantity": 1, "unit": "liter" } ] }
-        RULES: Singular, Lowercase names. Ignore taxes.
-        """
-        res = vision_model.generate_content([prompt, {"mime_type": file.content_type, "data": contents}])
-        data = json.loads(res.text.replace("```json", "").replace("```", "").strip())
+        try:
+            image = {"mime_type": "image/jpeg", "data": await asyncio.to_thread(shrink_image, contents)}
+        except OSError:
+            # PDFs and HEIC photos aren't decodable by Pillow; Gemini reads them as uploaded
+            image = {"mime_type": file.content_type, "data": contents}
+        data = await generate_json([BILL_PROMPT, image], BillResponse)
         
-        items = data.get("items", [])
-        logs = []
-        for item in items:
-            name = item["item"]
-            qty = float(item["quantity"])
-            existing = supabase.table("inventory").select("*").ilike("item_name", name).execute()
-            if existing.data:
-                new_qty = float(existing.data[0]['quantity']) + qty
-                supabase.table("inventory").update({"quantity": new_qty}).eq("id", existing.data[0]['id']).execute()
-            else:
-                supabase.table("inventory").insert({"item_name": name, "quantity": qty, "unit": "unit"}).execute()
-            logs.append(f"Added {name}")
+        items = data.items
+        logs = [f"Added {item.item}" for item in items]
+
+        # Existing items are incremented and new ones inserted in one adjust_inventory() call
+        changes = [{"item_name": item.item.lower(), "delta": item.quantity, "unit": item.unit} for item in items]
+        if changes:
+            bg.add_task(apply_changes, changes, True)
         return {"status": "success", "logs": logs}
     except Exception as e: return {"error": str(e)}
 
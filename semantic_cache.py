@@ -0,0 +1,135 @@
+import re
+import msgspec
+import time
+import sqlite3
+import threading
+import sqlite_vec
+from typing import Any
+
+EMBED_MODEL = 'sentence-transformers/all-MiniLM-L6-v2'
+EMBED_DIM = 384
+
+_TOKEN_RE = re.compile(r"\d+(?:\.\d+)?|[a-z]+")
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "dozen": 12,
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "hundred": 100,
+    "half": 0.5, "quarter": 0.25, "couple": 2, "few": 3,
+}
+
+
+def extract_numbers(text):
+    """Quantities mentioned in `text`, digits and number words alike ("two" == "2")."""
+    numbers = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token[0].isdigit():
+            numbers.append(str(float(token)))
+        elif token in _NUMBER_WORDS:
+            numbers.append(str(float(_NUMBER_WORDS[token])))
+    return " ".join(numbers)
+
+
+# Words that may directly precede an item name without changing which item it is
+_LEAD_WORDS = {
+    "used", "use", "ate", "had", "drank", "finished", "consumed", "and", "of", "the", "some", "my", "our",
+    *_NUMBER_WORDS,
+}
+
+
+def mentions(text, name):
+    """Whether `text` names the item `name` itself, not a longer name ending in it ("oat milk" isn't "milk")."""
+    for match in re.finditer(rf"\b{re.escape(name)}(?:e?s)?\b", text):
+        before = text[:match.start()].split()
+        if not before or before[-1].endswith(",") or before[-1] in _LEAD_WORDS or before[-1][0].isdigit():
+            return True
+    return False
+
+
+class SemanticCache:
+    """Serve cached Gemini output for paraphrased voice commands.
+
+    Embeddings live in a sqlite-vec table partitioned by namespace (user/session).
+    A neighbour only counts as a hit when its cosine similarity clears `threshold`
+    AND it mentions the same numbers, so "used two eggs" never answers "used 3 eggs".
+    Callers can pass `accept` to reject a decoded neighbour, e.g. one whose items the
+    new text doesn't name.
+    """
+
+    def __init__(self, path, threshold=0.92, ttl=24 * 3600):
+        self.threshold = threshold
+        self.ttl = ttl
+        self._model = None
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.enable_load_extension(True)
+        sqlite_vec.load(self.db)
+        self.db.enable_load_extension(False)
+        self.db.executescript(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS voice_vec USING vec0(
+                namespace text partition key,
+                embedding float[{EMBED_DIM}] distance_metric=cosine
+            );
+            CREATE TABLE IF NOT EXISTS voice_entries (
+                id INTEGER PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                numbers TEXT NOT NULL,
+                data BLOB NOT NULL,
+                created_at REAL NOT NULL
+            );
+        """)
+
+    def embed(self, text):
+        # Loaded lazily: the model is ~90 MB in memory and only needed on an exact-cache miss.
+        # Concurrent first misses each run in their own thread, so load it once under a lock.
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(EMBED_MODEL, device='cpu')
+        return self._model.encode(text, normalize_embeddings=True).tolist()
+
+    def lookup(self, namespace, text, type=Any, accept=None):
+        """Return (data, embedding); data is None on a miss. Blocking, run it off the event loop."""
+        embedding = self.embed(text)
+        numbers = extract_numbers(text)
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            neighbours = self.db.execute(
+                "SELECT rowid, distance FROM voice_vec "
+                "WHERE embedding MATCH ? AND k = 5 AND namespace = ? ORDER BY distance",
+                (sqlite_vec.serialize_float32(embedding), namespace),
+            ).fetchall()
+            for rowid, distance in neighbours:
+                if 1 - distance < self.threshold:
+                    break
+                entry = self.db.execute(
+                    "SELECT data FROM voice_entries WHERE id = ? AND numbers = ? AND created_at >= ?",
+                    (rowid, numbers, cutoff),
+                ).fetchone()
+                if entry:
+                    data = msgspec.json.decode(entry[0], type=type)
+                    if accept is None or accept(data):
+                        return data, embedding
+        return None, embedding
+
+    def store(self, namespace, text, embedding, data):
+        numbers = extract_numbers(text)
+        with self._lock, self.db:
+            self._evict_expired()
+            cur = self.db.execute(
+                "INSERT INTO voice_entries (namespace, numbers, data, created_at) VALUES (?, ?, ?, ?)",
+                (namespace, numbers, msgspec.json.encode(data), time.time()),
+            )
+            self.db.execute(
+                "INSERT INTO voice_vec (rowid, namespace, embedding) VALUES (?, ?, ?)",
+                (cur.lastrowid, namespace, sqlite_vec.serialize_float32(embedding)),
+            )
+
+    def _evict_expired(self):
+        expired = self.db.execute(
+            "SELECT id FROM voice_entries WHERE created_at < ?", (time.time() - self.ttl,)
+        ).fetchall()
+        if expired:
+            self.db.executemany("DELETE FROM voice_vec WHERE rowid = ?", expired)
+            self.db.executemany("DELETE FROM voice_entries WHERE id = ?", expired)
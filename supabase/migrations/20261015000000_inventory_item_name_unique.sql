@@ -0,0 +1,20 @@
+-- Bulk writes upsert on item_name (INSERT ... ON CONFLICT (item_name)),
+-- which needs a unique constraint to target.
+-- Merge any duplicate rows into the oldest one before adding it.
+UPDATE inventory AS keep
+SET quantity = dup.total
+FROM (
+    SELECT min(id) AS id, sum(quantity) AS total
+    FROM inventory
+    GROUP BY item_name
+    HAVING count(*) > 1
+) AS dup
+WHERE keep.id = dup.id;
+
+DELETE FROM inventory AS d
+USING inventory AS keep
+WHERE d.item_name = keep.item_name
+  AND d.id > keep.id;
+
+ALTER TABLE inventory
+    ADD CONSTRAINT inventory_item_name_key UNIQUE (item_name);
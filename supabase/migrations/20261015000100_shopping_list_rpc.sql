@@ -0,0 +1,15 @@
+-- Items below their restock threshold (unset or 0 means 2), with the shortfall
+-- computed server-side. Called from GET /shopping-list via supabase.rpc().
+CREATE OR REPLACE FUNCTION shopping_list()
+RETURNS TABLE (item_name text, quantity numeric, needed numeric, unit text)
+LANGUAGE sql STABLE
+AS $$
+    SELECT
+        item_name,
+        round(quantity::numeric, 2),
+        round((COALESCE(NULLIF(threshold, 0), 2.0) - quantity)::numeric, 2),
+        unit
+    FROM inventory
+    WHERE quantity < COALESCE(NULLIF(threshold, 0), 2.0)
+    ORDER BY item_name;
+$$;
@@ -0,0 +1,24 @@
+-- Item names are stored lowercase and looked up with eq() instead of
+-- ilike(), which could not use a b-tree index and scanned the table.
+
+-- Merge rows that only differ by case into the oldest one.
+UPDATE inventory AS keep
+SET quantity = dup.total
+FROM (
+    SELECT min(id) AS id, sum(quantity) AS total
+    FROM inventory
+    GROUP BY lower(item_name)
+    HAVING count(*) > 1
+) AS dup
+WHERE keep.id = dup.id;
+
+DELETE FROM inventory AS d
+USING inventory AS keep
+WHERE lower(d.item_name) = lower(keep.item_name)
+  AND d.id > keep.id;
+
+UPDATE inventory
+SET item_name = lower(item_name)
+WHERE item_name <> lower(item_name);
+
+CREATE UNIQUE INDEX IF NOT EXISTS inventory_name_lower ON inventory (lower(item_name));
@@ -0,0 +1,36 @@
+-- Apply quantity deltas atomically: changes is a JSON array of
+-- {"item_name", "delta", "unit"}. Existing rows are incremented in place
+-- (never below 0); missing names are inserted only when create_missing.
+-- Repeated names in one call are summed first.
+CREATE OR REPLACE FUNCTION adjust_inventory(changes jsonb, create_missing boolean DEFAULT false)
+RETURNS SETOF inventory
+LANGUAGE sql VOLATILE
+AS $$
+    WITH c AS (
+        SELECT
+            lower(x->>'item_name') AS item_name,
+            sum((x->>'delta')::numeric) AS delta,
+            max(COALESCE(x->>'unit', 'unit')) AS unit
+        FROM jsonb_array_elements(changes) AS x
+        GROUP BY 1
+    ), updated AS (
+        UPDATE inventory AS i
+        SET quantity = GREATEST(i.quantity + c.delta, 0)
+        FROM c
+        WHERE i.item_name = c.item_name
+        RETURNING i.*
+    ), inserted AS (
+        INSERT INTO inventory (item_name, quantity, unit)
+        SELECT c.item_name, GREATEST(c.delta, 0), c.unit
+        FROM c
+        WHERE create_missing
+          AND NOT EXISTS (SELECT 1 FROM inventory AS i WHERE i.item_name = c.item_name)
+        -- Row created by a concurrent request since our snapshot: add to it
+        ON CONFLICT (item_name) DO UPDATE
+            SET quantity = GREATEST(inventory.quantity + EXCLUDED.quantity, 0)
+        RETURNING *
+    )
+    SELECT * FROM updated
+    UNION ALL
+    SELECT * FROM inserted;
+$$;
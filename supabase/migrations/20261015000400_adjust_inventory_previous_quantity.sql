@@ -0,0 +1,45 @@
+-- adjust_inventory() also reports each row's quantity before the change, so
+-- /inventory/add and /inventory/consume don't need to SELECT it first.
+-- previous_quantity is NULL for rows this call inserted. The return type
+-- changes, so the function is dropped and recreated.
+DROP FUNCTION IF EXISTS adjust_inventory(jsonb, boolean);
+
+CREATE FUNCTION adjust_inventory(changes jsonb, create_missing boolean DEFAULT false)
+RETURNS TABLE (item_name text, quantity numeric, unit text, previous_quantity numeric)
+LANGUAGE sql VOLATILE
+AS $$
+    WITH c AS (
+        SELECT
+            lower(x->>'item_name') AS item_name,
+            sum((x->>'delta')::numeric) AS delta,
+            max(COALESCE(x->>'unit', 'unit')) AS unit
+        FROM jsonb_array_elements(changes) AS x
+        GROUP BY 1
+    ), locked AS (
+        -- Lock first so previous_quantity is the value this call actually adjusts
+        SELECT i.id, i.quantity
+        FROM inventory AS i
+        JOIN c ON i.item_name = c.item_name
+        FOR UPDATE OF i
+    ), updated AS (
+        UPDATE inventory AS i
+        SET quantity = GREATEST(i.quantity + c.delta, 0)
+        FROM c, locked
+        WHERE i.item_name = c.item_name
+          AND i.id = locked.id
+        RETURNING i.item_name, i.quantity, i.unit, locked.quantity AS previous_quantity
+    ), inserted AS (
+        INSERT INTO inventory (item_name, quantity, unit)
+        SELECT c.item_name, GREATEST(c.delta, 0), c.unit
+        FROM c
+        WHERE create_missing
+          AND NOT EXISTS (SELECT 1 FROM inventory AS i WHERE i.item_name = c.item_name)
+        -- Row created by a concurrent request since our snapshot: add to it
+        ON CONFLICT (item_name) DO UPDATE
+            SET quantity = GREATEST(inventory.quantity + EXCLUDED.quantity, 0)
+        RETURNING inventory.item_name, inventory.quantity, inventory.unit
+    )
+    SELECT item_name, quantity::numeric, unit, previous_quantity::numeric FROM updated
+    UNION ALL
+    SELECT item_name, quantity::numeric, unit, NULL::numeric FROM inserted;
+$$;
@@ -0,0 +1,43 @@
+import pytest
+
+from fast_path import match_simple_command, singularize
+
+INVENTORY = {"egg", "apple", "cookie", "brownie", "hummus", "couscous", "asparagus", "tomato", "loaf", "berry"}
+
+
+@pytest.mark.parametrize("word, expected", [
+    ("eggs", "egg"),
+    ("berries", "berry"),
+    ("tomatoes", "tomato"),
+    ("loaves", "loaf"),
+    ("glass", "glass"),
+])
+def test_singularize(word, expected):
+    assert singularize(word) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("used 2 eggs", ("egg", 2.0)),
+    ("i ate 1.5 apples", ("apple", 1.5)),
+    ("ate 3 cookies", ("cookie", 3.0)),
+    ("had 2 brownies", ("brownie", 2.0)),
+    ("used 1 hummus", ("hummus", 1.0)),
+    ("used 2 couscous", ("couscous", 2.0)),
+    ("used 4 asparagus", ("asparagus", 4.0)),
+    ("used 2 tomatoes", ("tomato", 2.0)),
+    ("used 1 loaves", ("loaf", 1.0)),
+    ("used 3 berries", ("berry", 3.0)),
+])
+def test_known_items_take_fast_path(text, expected):
+    assert match_simple_command(text, INVENTORY) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "had 3 kg",
+    "used 500 grams",
+    "used 2 bananas",
+    "used 2 eggs and 1 apple",
+    "add 2 eggs",
+])
+def test_everything_else_falls_through(text):
+    assert match_simple_command(text, INVENTORY) is None
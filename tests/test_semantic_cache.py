@@ -0,0 +1,38 @@
+import pytest
+
+from semantic_cache import extract_numbers, mentions
+
+
+@pytest.mark.parametrize("a, b", [
+    ("used two eggs", "used 2 eggs"),
+    ("used a banana", "used 1 banana"),
+    ("used half a liter of milk", "used 0.5 a liter of milk"),
+])
+def test_number_words_match_digits(a, b):
+    assert extract_numbers(a) == extract_numbers(b)
+
+
+def test_different_quantities_differ():
+    assert extract_numbers("used two eggs") != extract_numbers("used three eggs")
+
+
+@pytest.mark.parametrize("text, name", [
+    ("used 1 litre of milk", "milk"),
+    ("used 1 litre of oat milk", "oat milk"),
+    ("i used two eggs", "egg"),
+    ("used 2 tomatoes", "tomato"),
+    ("finished the bread", "bread"),
+    ("used 2 eggs, milk", "milk"),
+])
+def test_mentions(text, name):
+    assert mentions(text, name)
+
+
+@pytest.mark.parametrize("text, name", [
+    ("used 1 litre of oat milk", "milk"),
+    ("used 1 litre of milk", "oat milk"),
+    ("used soymilk", "milk"),
+    ("used 2 eggs", "bread"),
+])
+def test_does_not_mention(text, name):
+    assert not mentions(text, name)